@@ -13,45 +13,316 @@ Workflow:
 """
 from __future__ import annotations
 
+import atexit
+import hashlib
+import json
 import logging
+import logging.handlers
+import os
+import pickle
+import queue
 import threading
 import time
 import sys
 import random
+import signal
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from decimal import ROUND_DOWN, Decimal
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
+import colorlog
+import requests
+import websocket
 import yaml
+from backpack_exchange_sdk._base.errors import BackpackInsufficientFundsError, BackpackRateLimitError
 from backpack_exchange_sdk.authenticated import AuthenticationClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Utility trader class for full-margin orders
 from backpack_exchange_sdk.public import PublicClient
-import math
+
+try:
+    # orjson разбирает ответы API в 2-5 раз быстрее стандартного json
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    # python-json-logger >= 3.1; в старых версиях класс лежит в pythonjsonlogger.jsonlogger
+    from pythonjsonlogger.json import JsonFormatter
+except ImportError:
+    try:
+        from pythonjsonlogger.jsonlogger import JsonFormatter
+    except ImportError:
+        JsonFormatter = None
+
+
+class PriceUnavailable(Exception):
+    """No price source (stream, ticker, order book, trades) returned a price for the symbol."""
+
+    def __init__(self, symbol: str):
+        super().__init__(f"No price available for {symbol}")
+        self.symbol = symbol
+
+
+HTTP_POOL_SIZE = 32
+RATE_LIMIT_PER_SEC = 10.0
+RATE_LIMIT_BURST = 20.0
+# Одновременных запросов в полете на процесс: публичный и приватный (подписанный) API отдельно
+PUBLIC_CONCURRENCY = 8
+PRIVATE_CONCURRENCY = 4
+# (connect, read) в секундах: SDK передает timeout=None, а зависший сокет не должен держать слот вечно.
+# Только для GET: POST (ордер, вывод) после таймаута чтения мог исполниться, и повтор отправил бы его дважды,
+# поэтому для него ограничиваем лишь установку соединения - до нее запрос на биржу не ушел
+HTTP_TIMEOUT = (5.0, 20.0)
+POST_TIMEOUT = (HTTP_TIMEOUT[0], None)
+# Пауза для всех пар после ответа 429 без заголовка Retry-After, сек
+RATE_LIMIT_PENALTY = 2.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: tokens = min(burst, tokens + elapsed * refresh_rate)."""
+
+    def __init__(self, refresh_rate: float, burst: float):
+        self.refresh_rate = refresh_rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, refresh_rate: float, burst: float) -> None:
+        with self._lock:
+            self.refresh_rate = refresh_rate
+            self.burst = burst
+            self._tokens = min(self._tokens, burst)
+
+    def acquire(self) -> None:
+        """Take one token, sleeping until it is refilled if the bucket is empty."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # После penalize() _updated лежит в будущем: до этого момента токены не пополняются
+                self._tokens = min(self.burst, self._tokens + max(0.0, now - self._updated) * self.refresh_rate)
+                self._updated = max(self._updated, now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.refresh_rate + (self._updated - now)
+            time.sleep(wait)
+
+    def penalize(self, seconds: float) -> None:
+        """Drain the bucket after a 429 so every caller backs off; refilling resumes after `seconds`."""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = max(self._updated, time.monotonic() + seconds)
+
+    def penalty_remaining(self) -> float:
+        """Seconds until the bucket starts refilling after the last `penalize()`."""
+        with self._lock:
+            return max(0.0, self._updated - time.monotonic())
+
+
+def parse_retry_after(value: Optional[str], default: float = RATE_LIMIT_PENALTY) -> float:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), `default` if absent or invalid."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimitedSession(requests.Session):
+    """
+    Session that takes a token from `limiter` before every HTTP request and caps
+    in-flight requests separately for public and signed (private) endpoints.
+    """
+
+    def __init__(self, limiter: TokenBucket, public_concurrency: int = PUBLIC_CONCURRENCY, private_concurrency: int = PRIVATE_CONCURRENCY):
+        super().__init__()
+        self.limiter = limiter
+        self.timeout = HTTP_TIMEOUT
+        self.post_timeout = POST_TIMEOUT
+        self.set_concurrency(public_concurrency, private_concurrency)
+
+    def set_concurrency(self, public_concurrency: int, private_concurrency: int) -> None:
+        """Replace the in-flight caps; call before worker threads start."""
+        self._slots = {
+            False: threading.BoundedSemaphore(public_concurrency),
+            True: threading.BoundedSemaphore(private_concurrency),
+        }
+
+    def request(self, method, url, *args, **kwargs):
+        # SDK подписывает приватные запросы заголовком X-Signature
+        signed = "X-Signature" in (kwargs.get("headers") or {})
+        # setdefault не подходит: SDK передает timeout=None явно
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout if method.upper() == "GET" else self.post_timeout
+        self.limiter.acquire()
+        with self._slots[signed]:
+            response = super().request(method, url, *args, **kwargs)
+        if response.status_code == 429:
+            # Лимит общий для IP: останавливаем все пары, а не только получившую 429
+            self.limiter.penalize(parse_retry_after(response.headers.get("Retry-After")))
+        # SDK разбирает ответ через response.json() - подменяем парсер на json_loads
+        response.json = lambda **_: json_loads(response.content)
+        return response
+
+
+# Общий лимитер запросов к REST API для всех суб-аккаунтов процесса
+RATE_LIMITER = TokenBucket(RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return isinstance(error, BackpackRateLimitError) or getattr(error, "status_code", None) == 429
+
+
+INSUFFICIENT_FUNDS_CODES = frozenset({"INSUFFICIENT_FUNDS", "INSUFFICIENT_MARGIN"})
+
+
+def is_insufficient_funds(error: BaseException) -> bool:
+    """True if the API rejected a request because the collateral is locked or missing."""
+    if isinstance(error, BackpackInsufficientFundsError):
+        return True
+    if getattr(error, "code", None) in INSUFFICIENT_FUNDS_CODES:
+        return True
+    # Биржа может вернуть "Insufficient collateral" под общим кодом - проверяем только текст ответа
+    return "Insufficient collateral" in (getattr(error, "message", None) or "")
+
+
+def retry_delay(attempt: int, error: Optional[BaseException] = None, base: float = 1.0, cap: float = 30.0) -> float:
+    """
+    Delay before the next retry.
+
+    On HTTP 429 wait until the drained shared bucket refills (Retry-After, see RateLimitedSession);
+    otherwise exponential backoff with ±50% jitter so that concurrent pairs do not retry
+    in lockstep, clamped to [`base`, `cap`] after the jitter.
+    """
+    if error is not None and is_rate_limited(error):
+        return max(1.0 / RATE_LIMITER.refresh_rate, RATE_LIMITER.penalty_remaining())
+    return min(cap, max(base, base * 2 ** attempt * random.uniform(0.5, 1.5)))
+
+
+def build_http_session(pool_size: int = HTTP_POOL_SIZE, limiter: TokenBucket = RATE_LIMITER) -> requests.Session:
+    """Create a keep-alive, rate-limited session whose connection pool is shared by all API clients."""
+    session = RateLimitedSession(limiter)
+    # Повторы на уровне транспорта: обрывы соединения и 5xx только для GET - POST (ордер, вывод)
+    # повторно не отправляем, чтобы не исполнить его дважды. 429 обрабатывает TokenBucket/retry_delay
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+# Один пул соединений на процесс: TLS-сессии переиспользуются всеми суб-аккаунтами
+HTTP_SESSION = build_http_session()
+
+# Общий для всех суб-аккаунтов кэш рынка: symbol -> (price, step, decimals, price_expiry)
+# stepSize/decimals не устаревают, цена обновляется после истечения price_expiry
+MARKET_PRICE_TTL = 10.0
+_MARKET_CACHE: Dict[str, Tuple[float, Decimal, int, float]] = {}
+_MARKET_CACHE_LOCK = threading.RLock()
+
+# Ответ api/v1/markets, разложенный по символу, и время его устаревания
+MARKETS_TTL = 300.0
+_MARKETS_BY_SYMBOL: Dict[str, Dict] = {}
+_MARKETS_EXPIRY = 0.0
+
+# Сколько секунд можно переиспользовать полученную маржу внутри одной попытки ордера
+MARGIN_CACHE_TTL = 0.5
+
+
+def use_shared_session(client):
+    """Point an SDK client at the shared session instead of its private one."""
+    client.session = HTTP_SESSION
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_auth_client(api_key: str, api_secret: str) -> AuthenticationClient:
+    """
+    Return the process-wide client for an API key.
+
+    The ED25519 key is decoded once per key, and signing already runs on the calling
+    worker thread, so no pair ever waits on another pair's crypto.
+    """
+    return use_shared_session(AuthenticationClient(api_key, api_secret))
+
+
+@lru_cache(maxsize=None)
+def get_public_client() -> PublicClient:
+    """Return the process-wide public client; it holds no per-account state."""
+    return use_shared_session(PublicClient())
+
+
+# Запрос остановки (SIGINT/SIGTERM): пары закрывают позиции, выводят средства и завершаются
+SHUTDOWN = threading.Event()
+SHUTDOWN_TIMEOUT = 60.0
+# Пауза между повторами вывода после запроса остановки: backoff не должен съедать shutdown_timeout
+SHUTDOWN_RETRY_PAUSE = 1.0
+_SHUTDOWN_WAKERS: List[threading.Event] = []
+
+
+def request_shutdown(signum=None, frame=None) -> None:
+    """Signal handler: ask every worker to clean up and stop, waking those that wait on position events."""
+    SHUTDOWN.set()
+    for event in list(_SHUTDOWN_WAKERS):
+        event.set()
+
 
 class BackpackTrader:
     def __init__(self, api_key, api_secret):
-        self.auth = AuthenticationClient(api_key, api_secret)
-        self.pub = PublicClient()
-        self._market_cache = {}
+        self.auth = get_auth_client(api_key, api_secret)
+        self.pub = get_public_client()
+        self.price_ttl = MARKET_PRICE_TTL
+        self._margin = 0.0
+        self._margin_ts = float("-inf")
         
-    def get_available_margin(self) -> float:
-        """Return available USDC margin via collateral endpoint."""
+    def get_available_margin(self, max_age: float = 0.0) -> float:
+        """Return available USDC margin via collateral endpoint, reusing a value younger than `max_age` seconds."""
+        if max_age > 0 and time.monotonic() - self._margin_ts < max_age:
+            return self._margin
         try:
             resp = self.auth._send_request(
                 "GET", "api/v1/capital/collateral", "collateralQuery", {}
             )
             data = resp.get("data", resp) if isinstance(resp, dict) else resp
             items = data.get("collateral", data) if isinstance(data, dict) else data
-            for itm in items:
-                if itm.get("symbol") == "USDC":
-                    return float(itm.get("availableQuantity", 0) or 0)
-            return 0.0
+            usdc = next((itm for itm in items if itm.get("symbol") == USDC), None)
+            margin = float(usdc.get("availableQuantity", 0) or 0) if usdc else 0.0
+            self._margin, self._margin_ts = margin, time.monotonic()
+            return margin
         except Exception as e:
-            logging.error(f"BackpackTrader | margin fetch error: {e}")
+            logging.error("BackpackTrader | margin fetch error: %s", e)
             return 0.0
     
     def get_ticker_price(self, symbol: str) -> float:
-        """Get current market price from ticker endpoint."""
+        """
+        Get current market price from the ticker stream, falling back to the ticker endpoint,
+        the order book mid price and the last trade.
+
+        Raises PriceUnavailable if no source returns a price.
+        """
+        price = TICKER_STREAM.price(symbol)
+        if price is not None:
+            return price
         try:
             # Сначала используем публичный API для получения цены
             ticker = self.pub.get_ticker(symbol)
@@ -68,53 +339,31 @@ class BackpackTrader:
                 return float(resp["data"]["lastPrice"])
                 
             # Получаем orderbook и используем среднюю цену между лучшими бидом и аском
-            orderbook = self.pub.get_order_book(symbol)
+            # Лучшие цены берем по значению, а не по позиции: api/v1/depth сортирует обе стороны по возрастанию
+            orderbook = self.pub.get_depth(symbol)
             if isinstance(orderbook, dict):
                 bids = orderbook.get("bids", [])
                 asks = orderbook.get("asks", [])
                 if bids and asks:
-                    best_bid = float(bids[0][0])
-                    best_ask = float(asks[0][0])
+                    best_bid = max(float(level[0]) for level in bids)
+                    best_ask = min(float(level[0]) for level in asks)
                     return (best_bid + best_ask) / 2
                     
-            logging.warning(f"BackpackTrader | Failed to get ticker price for {symbol}, using backup method")
+            logging.warning("BackpackTrader | Failed to get ticker price for %s, using backup method", symbol)
             # Получаем цену через поиск сделок
-            trades = self.pub.get_trades(symbol, limit=1)
+            trades = self.pub.get_recent_trades(symbol, limit=1)
             if isinstance(trades, list) and trades and "price" in trades[0]:
                 return float(trades[0]["price"])
-            
-            # Если всё ещё нет цены, возвращаем резервное значение
-            return 138.0  # Примерная текущая цена SOL
         except Exception as e:
-            logging.error(f"BackpackTrader | ticker price error: {e}")
-            return 138.0  # Примерная текущая цена SOL
+            logging.error("BackpackTrader | ticker price error: %s", e)
+        # Выдуманная цена дала бы заведомо неверное количество и лишние ретраи ордера
+        raise PriceUnavailable(symbol)
             
     def get_market_info(self, symbol: str) -> Dict:
-        """Fetch market info with step size information."""
+        """Fetch market info with step size information (uncached, see `get_market_spec`)."""
         try:
-            # Используем кэш, если есть
-            if symbol in self._market_cache:
-                cached_info = self._market_cache[symbol]
-                # Дополним кэшированные данные актуальной ценой
-                if "lastPrice" not in cached_info or cached_info["lastPrice"] == "0":
-                    price = self.get_ticker_price(symbol)
-                    cached_info["lastPrice"] = str(price)
-                return cached_info
-                
-            # Получаем базовую информацию о рынке
-            resp = self.auth._send_request("GET", "api/v1/markets", "marketQuery", {})
-            markets = []
-            if isinstance(resp, dict) and "data" in resp:
-                markets = resp["data"]
-            elif isinstance(resp, list):
-                markets = resp
-                
-            # Ищем нужный рынок
-            market_info = None
-            for m in markets:
-                if m.get("symbol") == symbol:
-                    market_info = m
-                    break
+            # Ищем нужный рынок в словаре всех рынков
+            market_info = self.get_markets_by_symbol().get(symbol)
                     
             if not market_info:
                 # Прямой запрос к конкретному рынку
@@ -137,21 +386,21 @@ class BackpackTrader:
                     quantity_filter["stepSize"] = "0.01"  # Резервное значение
                     
                 market_info["baseIncrement"] = quantity_filter["stepSize"]
-                self._market_cache[symbol] = market_info
                 return market_info
                 
             # Резервные данные, если ничего не нашли
-            logging.warning(f"BackpackTrader | Using fallback market info for {symbol}")
+            logging.warning("BackpackTrader | Using fallback market info for %s", symbol)
             fallback = {
                 "symbol": symbol, 
                 "lastPrice": str(self.get_ticker_price(symbol)),
                 "baseIncrement": "0.01"
             }
-            self._market_cache[symbol] = fallback
             return fallback
             
+        except PriceUnavailable:
+            raise
         except Exception as e:
-            logging.error(f"BackpackTrader | market info error: {e}")
+            logging.error("BackpackTrader | market info error: %s", e)
             # Резервные значения в случае ошибки
             price = self.get_ticker_price(symbol)
             fallback = {
@@ -159,25 +408,69 @@ class BackpackTrader:
                 "lastPrice": str(price),
                 "baseIncrement": "0.01"
             }
-            self._market_cache[symbol] = fallback
             return fallback
             
+    def get_markets_by_symbol(self) -> Dict[str, Dict]:
+        """Return all markets keyed by symbol, refetching the list once it is older than MARKETS_TTL."""
+        global _MARKETS_BY_SYMBOL, _MARKETS_EXPIRY
+        with _MARKET_CACHE_LOCK:
+            if time.monotonic() < _MARKETS_EXPIRY:
+                return _MARKETS_BY_SYMBOL
+
+            resp = self.auth._send_request("GET", "api/v1/markets", "marketQuery", {})
+            markets = []
+            if isinstance(resp, dict) and "data" in resp:
+                markets = resp["data"]
+            elif isinstance(resp, list):
+                markets = resp
+
+            _MARKETS_BY_SYMBOL = {m["symbol"]: m for m in markets if m.get("symbol")}
+            _MARKETS_EXPIRY = time.monotonic() + MARKETS_TTL
+            return _MARKETS_BY_SYMBOL
+
+    def get_market_spec(self, symbol: str) -> Tuple[float, Decimal, int]:
+        """Return (price, step, decimals) from the shared market cache, refreshing stale data."""
+        # При первом промахе лок держится на время запроса: если short и long открываются
+        # параллельно, рынок запрашивает один поток, остальные получают результат из кэша
+        with _MARKET_CACHE_LOCK:
+            cached = _MARKET_CACHE.get(symbol)
+            if cached and cached[3] > time.monotonic():
+                return cached[:3]
+
+            if not cached:
+                info = self.get_market_info(symbol)
+                price = float(info.get("lastPrice", "0"))
+                # Decimal корректно разбирает и "0.001", и "1e-5"
+                step = Decimal(str(info.get("baseIncrement", "0.01")))
+                decimals = max(0, -step.as_tuple().exponent)
+                _MARKET_CACHE[symbol] = (price, step, decimals, time.monotonic() + self.price_ttl)
+                return price, step, decimals
+
+        # Метаданные рынка уже есть - обновляем только цену, вне лока: медленный запрос
+        # цены не должен задерживать остальные пары
+        step, decimals = cached[1], cached[2]
+        price = self.get_ticker_price(symbol)
+        with _MARKET_CACHE_LOCK:
+            _MARKET_CACHE[symbol] = (price, step, decimals, time.monotonic() + self.price_ttl)
+        return price, step, decimals
+
     def execute_full_margin_order(self, symbol: str, side: str, leverage: float = 1.0, retry_attempts: int = 5, min_delay: float = 1.0, max_delay: float = 15.0) -> bool:
         """Place a market order using all available margin with better error handling."""
         # Всего retry_attempts попыток
         for attempt in range(retry_attempts):
+            # Маржа запрашивается один раз на попытку и используется обоими методами
+            margin = self.get_available_margin(max_age=MARGIN_CACHE_TTL) * leverage
+            if margin <= 0:
+                logging.error("BackpackTrader | No margin available")
+                return False
+
             try:
                 # 1. Сначала пробуем метод с quoteQuantity (до 4 знаков после запятой)
-                margin = self.get_available_margin() * leverage
-                if margin <= 0:
-                    logging.error(f"BackpackTrader | No margin available")
-                    return False
-                    
                 # Округляем до 4 знаков после запятой, чтобы избежать ошибки "decimal too long"
                 quote_qty = round(margin, 4)
                 quote_qty_str = f"{quote_qty:.4f}"
                 
-                logging.info(f"BackpackTrader | Попытка {attempt+1}/{retry_attempts}: ордер на {quote_qty_str} USDC ({side})")
+                logging.info("BackpackTrader | Попытка %s/%s: ордер на %s USDC (%s)", attempt+1, retry_attempts, quote_qty_str, side)
                 result = self.auth.execute_order(
                     orderType="Market",
                     side=side,
@@ -190,49 +483,36 @@ class BackpackTrader:
                     autoLendRedeem=True,
                     selfTradePrevention="RejectTaker"
                 )
-                logging.info(f"BackpackTrader | Placed {side} order for {symbol} with quoteQuantity={quote_qty_str}")
+                logging.info("BackpackTrader | Placed %s order for %s with quoteQuantity=%s", side, symbol, quote_qty_str)
                 return True
             except Exception as e:
-                logging.warning(f"BackpackTrader | quoteQuantity order error (попытка {attempt+1}/{retry_attempts}): {e}")
+                logging.warning("BackpackTrader | quoteQuantity order error (попытка %s/%s): %s", attempt+1, retry_attempts, e)
+
+                # При 429 вторая заявка тоже будет отклонена - ждем пополнения лимита
+                if is_rate_limited(e):
+                    if attempt < retry_attempts - 1 and SHUTDOWN.wait(retry_delay(attempt, e)):
+                        return False
+                    continue
                 
                 # 2. Если первый метод не сработал, пробуем вычислить quantity
                 try:
-                    info = self.get_market_info(symbol)
-                    price = float(info.get("lastPrice", "0"))
-                    step = float(info.get("baseIncrement", "0.01"))
+                    price, step, _ = self.get_market_spec(symbol)
                     
                     if price <= 0:
                         price = self.get_ticker_price(symbol)
-                        
                     if price <= 0:
-                        logging.error(f"BackpackTrader | Could not get valid price for {symbol}")
-                        
-                        # Если не последняя попытка, ждем и пробуем снова
-                        if attempt < retry_attempts - 1:
-                            delay = random.uniform(min_delay, max_delay)
-                            logging.info(f"BackpackTrader | Ожидание {delay:.1f}с перед следующей попыткой")
-                            time.sleep(delay)
-                        continue  # Переходим к следующей попытке
-                        
-                    margin = self.get_available_margin() * leverage
-                    if margin <= 0:
-                        logging.error(f"BackpackTrader | No margin available")
-                        return False
-                        
-                    # Вычисляем количество с учетом шага
-                    raw_qty = margin / price
-                    steps = math.floor(raw_qty / step)
-                    qty = steps * step
-                    
-                    # Минимальное значение
-                    if qty < 0.01:
-                        qty = 0.01
+                        raise PriceUnavailable(symbol)
                         
-                    # Округляем до правильного количества знаков
-                    decimals = len(str(step).split('.')[-1]) if '.' in str(step) else 0
-                    qty_str = f"{qty:.{decimals}f}"
+                    # Вычисляем количество, округляя вниз до целого числа шагов
+                    qty = floor_to_step(Decimal(str(margin)) / Decimal(str(price)), step)
+
+                    # Минимальное значение - один шаг
+                    if qty < step:
+                        qty = step
+
+                    qty_str = format(qty, "f")
                     
-                    logging.info(f"BackpackTrader | Attempting order with quantity={qty_str}, price={price}")
+                    logging.info("BackpackTrader | Attempting order with quantity=%s, price=%s", qty_str, price)
                     result = self.auth.execute_order(
                         orderType="Market",
                         side=side,
@@ -245,16 +525,25 @@ class BackpackTrader:
                         autoLendRedeem=True,
                         selfTradePrevention="RejectTaker"
                     )
-                    logging.info(f"BackpackTrader | Placed {side} order for {symbol} with quantity={qty_str}")
+                    logging.info("BackpackTrader | Placed %s order for %s with quantity=%s", side, symbol, qty_str)
                     return True
+                except PriceUnavailable as pe:
+                    # Без цены количество не посчитать - следующая попытка снова через quoteQuantity
+                    logging.error("BackpackTrader | %s, skipping quantity order", pe)
+                    if attempt < retry_attempts - 1:
+                        delay = retry_delay(attempt, base=min_delay, cap=max_delay)
+                        logging.info("BackpackTrader | Ожидание %.1fс перед следующей попыткой", delay)
+                        if SHUTDOWN.wait(delay):
+                            return False
                 except Exception as e2:
-                    logging.error(f"BackpackTrader | quantity order error (попытка {attempt+1}/{retry_attempts}): {e2}")
+                    logging.error("BackpackTrader | quantity order error (попытка %s/%s): %s", attempt+1, retry_attempts, e2)
                 
-                    # Если это не последняя глобальная попытка, делаем паузу согласно конфигу
+                    # Если это не последняя глобальная попытка, делаем паузу с учетом причины ошибки
                     if attempt < retry_attempts - 1:
-                        delay = random.uniform(min_delay, max_delay)
-                        logging.info(f"BackpackTrader | Ожидание {delay:.1f}с перед следующей попыткой")
-                        time.sleep(delay)
+                        delay = retry_delay(attempt, e2, base=min_delay, cap=max_delay)
+                        logging.info("BackpackTrader | Ожидание %.1fс перед следующей попыткой", delay)
+                        if SHUTDOWN.wait(delay):
+                            return False
             
         return False  # Если все попытки не удались
                     
@@ -268,28 +557,298 @@ class BackpackTrader:
 USDC = "USDC"
 BLOCKCHAIN = "Solana"
 LEVERAGE_DEFAULT = 50
+WS_URL = "wss://ws.backpack.exchange"
+POSITION_STREAM = "account.positionUpdate"
+TICKER_MAX_AGE = 2.0  # сек, после которых цена из потока считается устаревшей
+
+USDC_STEP = Decimal("0.000001")  # точность количества USDC при выводе
+
+T = TypeVar("T")
+
+
+def floor_to_step(value: Decimal, step: Decimal) -> Decimal:
+    """Largest whole multiple of `step` not above `value`, computed exactly (no float rounding up)."""
+    return ((value / step).to_integral_value(rounding=ROUND_DOWN) * step).quantize(step)
+
+
+@lru_cache(maxsize=None)
+def symbol_variants(symbol: str) -> frozenset:
+    """All spellings of a market symbol the API may return (SOL_USDC_PERP / SOL-USDC-PERP)."""
+    return frozenset((symbol, symbol.replace("_", "-"), symbol.replace("-", "_")))
+
+
+class ReconnectingStream(ABC):
+    """
+    One persistent WebSocket connection to Backpack with a subscribe timeout and
+    exponential-backoff reconnects. Subclasses build the SUBSCRIBE frame and handle data frames.
+    """
+
+    label = "Stream"
+
+    def __init__(self, name: str, ack_timeout: float = 10.0, max_backoff: float = 60.0, stable_after: float = 300.0):
+        self.name = name
+        self.ack_timeout = ack_timeout
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._last_message = 0.0
+        self._ws: Optional[websocket.WebSocketApp] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the receive thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-{self.label}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._ws:
+            self._ws.close()
+
+    @abstractmethod
+    def _subscribe_frame(self) -> Dict:
+        """SUBSCRIBE frame sent on every (re)connect."""
+
+    @abstractmethod
+    def _on_data(self, stream: str, data: Dict) -> None:
+        """Handle one data frame; called in the receive thread."""
+
+    def _on_disconnect(self) -> None:
+        """Hook called every time the socket drops."""
+
+    def _run(self) -> None:
+        attempt = 0
+        while not self._stop.is_set():
+            opened_at = time.monotonic()
+            self._ws = websocket.WebSocketApp(
+                WS_URL,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=lambda ws, e: logging.warning("%s | %s error: %s", self.name, self.label, e),
+            )
+            watchdog = threading.Timer(self.ack_timeout, self._check_ack, args=(self._ws,))
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                # UTF-8 кадров без wsaccel проверяется на чистом Python; без проверки websocket-client не декодирует
+                # кадр и отдает в _on_message bytes - их принимают и orjson, и json.loads, битый UTF-8 они отвергнут
+                self._ws.run_forever(ping_interval=30, ping_timeout=10, skip_utf8_validation=True)
+            except Exception as e:
+                logging.warning("%s | %s crashed: %s", self.name, self.label, e)
+            finally:
+                watchdog.cancel()
+                self._connected.clear()
+                self._on_disconnect()
+
+            if self._stop.is_set():
+                break
+            # Сбрасываем backoff, если соединение продержалось дольше stable_after
+            attempt = 0 if time.monotonic() - opened_at > self.stable_after else attempt + 1
+            delay = min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1.0)
+            logging.info("%s | %s disconnected, reconnecting in %.1fs", self.name, self.label, delay)
+            self._stop.wait(delay)
+
+    def _check_ack(self, ws: websocket.WebSocketApp) -> None:
+        """Drop the connection if it was not opened and subscribed within `ack_timeout`."""
+        if ws is self._ws and not self._connected.is_set():
+            logging.warning("%s | %s subscribe timed out", self.name, self.label)
+            ws.close()
+
+    def _on_open(self, ws: websocket.WebSocketApp) -> None:
+        ws.send(json.dumps(self._subscribe_frame()))
+        self._last_message = time.monotonic()
+        self._connected.set()
+        logging.info("%s | %s: подписка активна", self.name, self.label)
+
+    def _on_message(self, ws: websocket.WebSocketApp, message: bytes) -> None:
+        try:
+            msg = json_loads(message)
+        except ValueError:
+            return
+        if "error" in msg:
+            logging.error("%s | %s rejected subscription: %s", self.name, self.label, msg['error'])
+            self._connected.clear()
+            ws.close()
+            return
+        stream, data = msg.get("stream"), msg.get("data")
+        if stream and isinstance(data, dict):
+            self._last_message = time.monotonic()
+            self._on_data(stream, data)
+
+
+class PositionStream(ReconnectingStream):
+    """
+    Persistent private WebSocket subscription to position updates of one account.
+
+    Keeps `symbol -> position` snapshot that is seeded via REST after every
+    (re)connect and then kept current by pushed `account.positionUpdate` events.
+    While the stream is not live (disconnected, not yet seeded or seeded more than
+    `resync_interval` ago), callers must fall back to REST and re-seed it.
+    """
+
+    label = "Position stream"
+
+    def __init__(self, name: str, auth: AuthenticationClient, resync_interval: float = 300.0, **kwargs):
+        super().__init__(name, stable_after=resync_interval, **kwargs)
+        self.auth = auth
+        self.resync_interval = resync_interval
+        self._positions: Dict[str, Dict] = {}
+        self._updated_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._seeded_at = 0.0
+        self._close_listeners: List[threading.Event] = []
+
+    def is_live(self) -> bool:
+        """True if the snapshot can be trusted without a REST round trip."""
+        if not self._connected.is_set() or not self._seeded_at:
+            return False
+        # Снимок пересверяется с REST каждые resync_interval, даже если поток активен:
+        # пропущенное событие иначе жило бы в кэше до переподключения
+        return time.monotonic() - self._seeded_at < self.resync_interval
+
+    def notify_on_close(self, event: threading.Event) -> None:
+        """Set `event` whenever the exchange pushes a position close (liquidation included)."""
+        self._close_listeners.append(event)
+
+    def positions(self) -> List[Dict]:
+        with self._lock:
+            return list(self._positions.values())
+
+    def seed(self, positions: List[Dict], started_at: float) -> None:
+        """
+        Replace the snapshot with a REST result fetched at `started_at` (monotonic).
+
+        Symbols updated by the stream after the REST request was sent keep their pushed state.
+        """
+        with self._lock:
+            seeded = {p.get("symbol"): p for p in positions if p.get("symbol")}
+            for s, ts in self._updated_at.items():
+                if ts <= started_at:
+                    continue
+                if s in self._positions:
+                    seeded[s] = self._positions[s]
+                else:
+                    seeded.pop(s, None)
+            self._positions = seeded
+            if self._connected.is_set():
+                self._seeded_at = time.monotonic()
+
+    def _subscribe_frame(self) -> Dict:
+        ts = int(time.time() * 1000)
+        window = getattr(self.auth, "window", 5000)
+        signature = self.auth._sign_message(f"instruction=subscribe&timestamp={ts}&window={window}")
+        return {
+            "method": "SUBSCRIBE",
+            "params": [POSITION_STREAM],
+            "signature": [self.auth.key, signature, str(ts), str(window)],
+        }
+
+    def _on_disconnect(self) -> None:
+        self._seeded_at = 0.0
+
+    def _on_data(self, stream: str, data: Dict) -> None:
+        symbol = data.get("s")
+        if stream != POSITION_STREAM or not symbol:
+            return
+        with self._lock:
+            self._updated_at[symbol] = time.monotonic()
+            qty = data.get("q", "0")
+            if data.get("e") == "positionClosed" or not float(qty or 0):
+                self._positions.pop(symbol, None)
+                for event in self._close_listeners:
+                    event.set()
+                return
+            # Приводим событие к формату ответа REST `api/v1/position`
+            self._positions[symbol] = {
+                "symbol": symbol,
+                "netQuantity": qty,
+                "entryPrice": data.get("B"),
+                "markPrice": data.get("M"),
+                "estLiquidationPrice": data.get("l"),
+                "unrealizedPnl": data.get("P"),
+            }
+
+
+class TickerStream(ReconnectingStream):
+    """
+    Shared public `ticker.<symbol>` subscription for every symbol the process trades.
+
+    Started lazily by the first `price()` call; later symbols are added to the same socket.
+    """
+
+    label = "Ticker stream"
+
+    def __init__(self, max_age: float = TICKER_MAX_AGE, **kwargs):
+        super().__init__("TICKER", **kwargs)
+        self.max_age = max_age
+        self._symbols: set = set()
+        self._prices: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def price(self, symbol: str) -> Optional[float]:
+        """Last pushed price if younger than `max_age`, otherwise None (caller falls back to REST)."""
+        self.track(symbol)
+        with self._lock:
+            cached = self._prices.get(symbol)
+        if cached and time.monotonic() - cached[1] < self.max_age:
+            return cached[0]
+        return None
+
+    def track(self, symbol: str) -> None:
+        with self._lock:
+            if symbol in self._symbols:
+                return
+            self._symbols.add(symbol)
+        self.start()
+        if self._connected.is_set():
+            try:
+                self._ws.send(json.dumps({"method": "SUBSCRIBE", "params": [f"ticker.{symbol}"]}))
+            except Exception as e:
+                # Символ уже в списке - подписка восстановится при переподключении
+                logging.warning("%s | Ticker subscribe error for %s: %s", self.name, symbol, e)
+
+    def _subscribe_frame(self) -> Dict:
+        with self._lock:
+            return {"method": "SUBSCRIBE", "params": [f"ticker.{s}" for s in sorted(self._symbols)]}
+
+    def _on_data(self, stream: str, data: Dict) -> None:
+        symbol, last_price = data.get("s"), data.get("c")
+        if stream.startswith("ticker.") and symbol and last_price:
+            with self._lock:
+                self._prices[symbol] = (float(last_price), time.monotonic())
+
+
+# Одно публичное соединение на процесс для цен всех торгуемых символов
+TICKER_STREAM = TickerStream()
+
 
 class SubAccount:
-    def __init__(self, cfg: Dict, is_long: bool, leverage: float):
-        self.name = cfg["name"]
-        self.address = cfg["address"]
+    def __init__(self, cfg: AccountCfg, is_long: bool, leverage: float, resync_interval: float = 300.0):
+        self.name = cfg.name
+        self.address = cfg.address
         self.is_long = is_long
         self.leverage = leverage
-        self.trader = BackpackTrader(cfg["api_key"], cfg["api_secret"])
+        self.trader = BackpackTrader(cfg.api_key, cfg.api_secret)
         self.min_delay = 1.0
         self.max_delay = 1.0
         self.retry_attempts = 8  # Maximum number of attempts to open a position
+        self.stream = PositionStream(self.name, self.trader.auth, resync_interval=resync_interval)
+        self._last_logged_state: Dict[str, Optional[str]] = {}
 
     def random_delay(self):
         """Execute a random delay between min_delay and max_delay seconds."""
         delay = random.uniform(self.min_delay, self.max_delay)
-        logging.info(f"{self.name} | Delaying for {delay:.1f}s")
+        logging.info("%s | Delaying for %.1fs", self.name, delay)
         time.sleep(delay)
 
     def open_position(self, symbol: str) -> bool:
         """Open a position with retries and delays."""
         for attempt in range(self.retry_attempts):
-            logging.info(f"{self.name} | Opening position attempt {attempt+1}/{self.retry_attempts}")
+            logging.info("%s | Opening position attempt %s/%s", self.name, attempt+1, self.retry_attempts)
             if self.is_long:
                 success = self.trader.execute_full_margin_order(
                     symbol, 
@@ -310,115 +869,122 @@ class SubAccount:
                 )
                     
             if success:
-                logging.info(f"{self.name} | Position opened successfully")
+                logging.info("%s | Position opened successfully", self.name)
                 return True
                     
             if attempt < self.retry_attempts - 1:
-                delay = random.uniform(self.min_delay, self.max_delay)  # Используем задержку из конфига
-                logging.info(f"{self.name} | Retrying after {delay:.1f}s...")
-                time.sleep(delay)
+                delay = retry_delay(attempt, base=self.min_delay, cap=self.max_delay)
+                logging.info("%s | Retrying after %.1fs...", self.name, delay)
+                if SHUTDOWN.wait(delay):
+                    # Остановка: новые позиции не открываем
+                    logging.info("%s | Остановка, открытие позиции прервано", self.name)
+                    return False
                     
-        logging.error(f"{self.name} | Failed to open position after {self.retry_attempts} attempts")
+        logging.error("%s | Failed to open position after %s attempts", self.name, self.retry_attempts)
         return False
 
-    def has_position(self, symbol: str) -> bool:
-        """Проверка наличия позиции с использованием правильного эндпоинта."""
-        try:
+    def _fetch_positions(self) -> Dict[str, Dict]:
+        """Return open positions keyed by symbol: pushed snapshot if the stream is live, else REST."""
+        if self.stream.is_live():
+            positions = self.stream.positions()
+        else:
+            started_at = time.monotonic()
             # Используем правильный эндпоинт, как в репозитории 0xCherryDAO/backpack
             positions_response = self.trader.auth._send_request("GET", "api/v1/position", "positionQuery", {})
-            
+
             # Преобразуем ответ в список позиций
             positions = []
             if isinstance(positions_response, dict) and "data" in positions_response:
                 positions = positions_response["data"]
             elif isinstance(positions_response, list):
                 positions = positions_response
-            
-            # Логируем общее количество найденных позиций
-            if positions:
-                logging.info(f"{self.name} | Найдено {len(positions)} позиций")
-                
-                # Проверяем минимальное соответствие - просто наличие позиции с правильным символом
-                for pos in positions:
-                    pos_symbol = pos.get("symbol", "")
-                    
-                    # Проверка всех вариантов символа
-                    symbol_variants = [
-                        symbol,
-                        symbol.replace("_", "-"),
-                        symbol.replace("-", "_")
-                    ]
-                    
-                    if pos_symbol in symbol_variants:
-                        # Если символ совпадает, считаем что позиция существует
-                        
-                        # Попытаемся получить дополнительную информацию, если она есть
-                        pos_size = pos.get("netQuantity", pos.get("size", "Неизвестно"))
-                        entry_price = pos.get("entryPrice", "Неизвестно")
-                        mark_price = pos.get("markPrice", entry_price)
-                        liq_price = pos.get("estLiquidationPrice", "Неизвестно")
-                        pnl = pos.get("unrealizedPnl", "Неизвестно")
-                        
-                        # Расчет размера в долларах
-                        size_dollars = "Неизвестно"
-                        try:
-                            if pos_size != "Неизвестно" and entry_price != "Неизвестно":
-                                size_value = float(pos_size)
-                                entry_value = float(entry_price)
-                                size_dollars = abs(size_value * entry_value)
-                                size_dollars = f"{size_dollars:.2f} USDC"
-                        except:
-                            pass
-                            
-                        # Более понятное отображение направления позиции
-                        side_txt = "LONG" if str(pos_size).startswith('3') or str(pos_size).startswith('+') else "SHORT"
-                        
-                        logging.info(f"{self.name} | {side_txt} ПОЗИЦИЯ: {pos_symbol}, размер={pos_size} (~{size_dollars}), вход={entry_price}, тек.цена={mark_price}, ликв.={liq_price}, PnL={pnl}")
-                        return True
-                
-                # Если ни одна позиция не подходит по символу
-                logging.info(f"{self.name} | Не найдено позиций для символа {symbol}")
-                return False
-            else:
-                logging.info(f"{self.name} | Позиции не найдены")
-                return False
-            
+            self.stream.seed(positions, started_at)
+        return {p["symbol"]: p for p in positions if p.get("symbol")}
+
+    def fetch_position(self, symbol: str) -> Optional[Dict]:
+        """
+        Позиция по символу (с учетом вариантов написания) или None, если ее нет.
+
+        Ошибка запроса пробрасывается: "не удалось проверить" нельзя путать с "позиции нет".
+        """
+        positions = self._fetch_positions()
+        pos = next((positions[v] for v in symbol_variants(symbol) if v in positions), None)
+        self._log_position_once(symbol, pos)
+        return pos
+
+    def has_position(self, symbol: str) -> Optional[Dict]:
+        """Проверка наличия позиции по символу; при ошибке запроса возвращает None (для необязательных проверок)."""
+        try:
+            return self.fetch_position(symbol)
         except Exception as e:
-            logging.warning(f"{self.name} | Ошибка при проверке позиций: {e}")
-            return False
+            logging.warning("%s | Ошибка при проверке позиций: %s", self.name, e)
+            return None
+
+    def _log_position_once(self, symbol: str, pos: Optional[Dict]) -> None:
+        """Log the position only when it appears, disappears or changes size."""
+        state = pos.get("netQuantity", pos.get("size")) if pos else None
+        if self._last_logged_state.get(symbol, "") == state:
+            return
+        self._last_logged_state[symbol] = state
+
+        if pos is None:
+            logging.info("%s | Не найдено позиций для символа %s", self.name, symbol)
+            return
+
+        try:
+            side_txt = "LONG" if float(state) > 0 else "SHORT"
+        except (TypeError, ValueError):
+            side_txt = "?"
+        entry_price = pos.get("entryPrice", "Неизвестно")
+        logging.info(
+            "%s | %s ПОЗИЦИЯ: %s, размер=%s, вход=%s, ликв.=%s",
+            self.name, side_txt, pos.get("symbol"), state, entry_price, pos.get("estLiquidationPrice", "Неизвестно"),
+        )
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            try:
+                size_dollars = f"{abs(float(state) * float(entry_price)):.2f} USDC"
+            except (TypeError, ValueError):
+                size_dollars = "Неизвестно"
+            logging.debug(
+                "%s | %s: ~%s, тек.цена=%s, PnL=%s",
+                self.name, pos.get("symbol"), size_dollars, pos.get("markPrice", entry_price), pos.get("unrealizedPnl", "Неизвестно"),
+            )
     
-    def close_position(self, symbol: str) -> bool:
-        """Закрытие позиции с использованием рабочего метода."""
-        if not self.has_position(symbol):
-            logging.info(f"{self.name} | Нет позиции для закрытия")
+    def close_position(self, symbol: str, pos: Optional[Dict] = None) -> bool:
+        """
+        Закрытие позиции с использованием рабочего метода.
+
+        `pos` - позиция, уже полученная через fetch_position(); без нее позиции запрашиваются один раз.
+        Если позиции не удалось получить, возвращает False: закрытие не подтверждено.
+        """
+        if pos is None:
+            try:
+                pos = self.fetch_position(symbol)
+            except Exception as e:
+                logging.error("%s | Не удалось получить позицию для закрытия: %s", self.name, e)
+                return False
+        if pos is None:
+            logging.info("%s | Нет позиции для закрытия", self.name)
             return True  # Нет позиции - считаем успешным закрытием
             
         side = "Ask" if self.is_long else "Bid"  # Bid для покупки, Ask для продажи
         
-        try:
-            # Запрос на получение информации о позиции для определения её размера
-            positions = self.trader.auth._send_request("GET", "api/v1/position", "positionQuery", {})
-            
-            for pos in positions:
-                if pos.get("symbol") == symbol:
-                    # Получаем размер позиции
-                    size = pos.get("netQuantity", "0")
-                    if size:
-                        try:
-                            # Создаем ордер с указанием размера позиции
-                            result = self.trader.auth.execute_order(
-                                orderType="Market",
-                                side=side,
-                                symbol=symbol,
-                                reduceOnly=True,
-                                quantity=str(abs(float(size)))
-                            )
-                            logging.info(f"{self.name} | Позиция закрыта успешно: размер={size}")
-                            return True
-                        except Exception as e:
-                            logging.error(f"{self.name} | Ошибка закрытия позиции: {e}")
-        except Exception as e:
-            logging.error(f"{self.name} | Ошибка при получении данных о позиции: {e}")
+        # Размер берем из той же позиции - повторный запрос /position не нужен
+        size = pos.get("netQuantity", "0")
+        if size:
+            try:
+                # Создаем ордер с указанием размера позиции
+                result = self.trader.auth.execute_order(
+                    orderType="Market",
+                    side=side,
+                    symbol=symbol,
+                    reduceOnly=True,
+                    quantity=str(abs(float(size)))
+                )
+                logging.info("%s | Позиция закрыта успешно: размер=%s", self.name, size)
+                return True
+            except Exception as e:
+                logging.error("%s | Ошибка закрытия позиции: %s", self.name, e)
         
         # Если не удалось получить размер или закрыть позицию, пробуем с фиксированным размером
         try:
@@ -431,116 +997,173 @@ class SubAccount:
                 reduceOnly=True,
                 quantity=fixed_size
             )
-            logging.info(f"{self.name} | Позиция закрыта с фиксированным размером {fixed_size}")
+            logging.info("%s | Позиция закрыта с фиксированным размером %s", self.name, fixed_size)
             return True
         except Exception as e:
-            logging.error(f"{self.name} | Не удалось закрыть позицию: {e}")
+            logging.error("%s | Не удалось закрыть позицию: %s", self.name, e)
             return False
 
     def sweep(self, main_address: str, max_attempts: int = 8) -> bool:
         """Withdraw all available funds to the main account with improved retries."""
         balance = self.trader.get_available_margin()
         if balance <= 0.1:  # Минимальный порог для вывода
-            logging.info(f"{self.name} | Недостаточно средств для вывода: {balance} USDC")
+            logging.info("%s | Недостаточно средств для вывода: %s USDC", self.name, balance)
             return True  # Считаем успешным, если нечего выводить
             
-        # Округляем до 6 десятичных знаков
-        qty = round(balance, 6)
-        qty_str = f"{qty:.6f}"
+        # Округляем вниз до 6 десятичных знаков: round() мог округлить выше доступного баланса
+        qty = floor_to_step(Decimal(str(balance)), USDC_STEP)
+        qty_str = format(qty, "f")
+        # Между попытками меняется только количество
+        withdrawal = {"address": main_address, "blockchain": BLOCKCHAIN, "symbol": USDC}
         
         for attempt in range(max_attempts):  # Увеличено до 8 попыток
             try:
-                result = self.trader.auth.request_withdrawal(
-                    address=main_address,
-                    blockchain=BLOCKCHAIN,
-                    quantity=qty_str,
-                    symbol=USDC
-                )
-                logging.info(f"{self.name} | Выведено {qty_str} USDC на основной счет")
+                result = self.trader.auth.request_withdrawal(quantity=qty_str, **withdrawal)
+                logging.info("%s | Выведено %s USDC на основной счет", self.name, qty_str)
                 return True
             except Exception as e:
-                logging.warning(f"{self.name} | Ошибка вывода средств (попытка {attempt+1}/{max_attempts}): {e}")
+                logging.warning("%s | Ошибка вывода средств (попытка %s/%s): %s", self.name, attempt+1, max_attempts, e)
                 
-                if "Insufficient collateral" in str(e):
-                    logging.info(f"{self.name} | Средства могут быть заблокированы в позиции, пробуем меньшую сумму")
+                if is_insufficient_funds(e):
+                    logging.info("%s | Средства могут быть заблокированы в позиции, пробуем меньшую сумму", self.name)
                     # Пробуем вывести меньшую сумму
                     try:
-                        qty *= 0.5  # Уменьшаем сумму вдвое
-                        if qty < 0.1:  # Если слишком мало, прекращаем
-                            logging.warning(f"{self.name} | Оставшаяся сумма слишком мала для вывода: {qty} USDC")
+                        qty = floor_to_step(qty / 2, USDC_STEP)  # Уменьшаем сумму вдвое
+                        if qty < Decimal("0.1"):  # Если слишком мало, прекращаем
+                            logging.warning("%s | Оставшаяся сумма слишком мала для вывода: %s USDC", self.name, qty)
                             return False
-                        qty_str = f"{qty:.6f}"
-                        result = self.trader.auth.request_withdrawal(
-                            address=main_address,
-                            blockchain=BLOCKCHAIN,
-                            quantity=qty_str,
-                            symbol=USDC
-                        )
-                        logging.info(f"{self.name} | Выведена уменьшенная сумма {qty_str} USDC на основной счет")
+                        qty_str = format(qty, "f")
+                        result = self.trader.auth.request_withdrawal(quantity=qty_str, **withdrawal)
+                        logging.info("%s | Выведена уменьшенная сумма %s USDC на основной счет", self.name, qty_str)
                         return True
                     except Exception as e2:
-                        logging.error(f"{self.name} | Не удалось вывести уменьшенную сумму: {e2}")
+                        logging.error("%s | Не удалось вывести уменьшенную сумму: %s", self.name, e2)
                 
                 # Если это не последняя попытка, делаем паузу
                 if attempt < max_attempts - 1:
-                    # Используем экспоненциальную задержку с добавлением случайности
-                    base_delay = min(2 ** attempt, 30)  # Экспоненциальное увеличение, но не более 30 сек
-                    delay = random.uniform(base_delay, base_delay * 1.5)  # Случайность ±50%
-                    logging.info(f"{self.name} | Ожидание {delay:.1f}с перед следующей попыткой вывода")
-                    time.sleep(delay)
+                    # Экспоненциальная задержка со случайностью (не более 30 сек), при 429 - до пополнения лимита
+                    delay = retry_delay(attempt, e)
+                    logging.info("%s | Ожидание %.1fс перед следующей попыткой вывода", self.name, delay)
+                    if SHUTDOWN.is_set():
+                        # Вывод - часть очистки при остановке, не прерываем его, только укорачиваем паузы
+                        time.sleep(min(delay, SHUTDOWN_RETRY_PAUSE))
+                    else:
+                        SHUTDOWN.wait(delay)
                     
                     # Проверяем баланс заново перед следующей попыткой
                     try:
                         new_balance = self.trader.get_available_margin()
                         if new_balance != balance:
-                            logging.info(f"{self.name} | Баланс изменился: {balance} -> {new_balance} USDC")
+                            logging.info("%s | Баланс изменился: %s -> %s USDC", self.name, balance, new_balance)
                             balance = new_balance
-                            qty = round(balance, 6)
-                            qty_str = f"{qty:.6f}"
+                            qty = floor_to_step(Decimal(str(balance)), USDC_STEP)
+                            qty_str = format(qty, "f")
                     except Exception as e3:
-                        logging.warning(f"{self.name} | Ошибка обновления баланса: {e3}")
+                        logging.warning("%s | Ошибка обновления баланса: %s", self.name, e3)
                         
-        logging.error(f"{self.name} | Не удалось вывести средства после {max_attempts} попыток")
+        logging.error("%s | Не удалось вывести средства после %s попыток", self.name, max_attempts)
         return False
 
 
-def worker_pair(short_cfg: Dict, long_cfg: Dict, cfg: Dict, main_address: str, delay_start: float = 0) -> None:
+_PAIRED_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def start_paired_pool(pair_count: int) -> ThreadPoolExecutor:
+    """Create the process-wide pool for run_paired: two workers per pair, spawned on demand and reused."""
+    global _PAIRED_POOL
+    _PAIRED_POOL = ThreadPoolExecutor(max_workers=max(2, 2 * pair_count), thread_name_prefix="paired")
+    return _PAIRED_POOL
+
+
+def submit_paired(short_call: Callable[[], T], long_call: Callable[[], T]) -> Tuple[Future, Future]:
+    """Start two independent per-account calls on the shared pool without waiting for them."""
+    pool = _PAIRED_POOL or start_paired_pool(1)
+    return pool.submit(short_call), pool.submit(long_call)
+
+
+def run_paired(short_call: Callable[[], T], long_call: Callable[[], T]) -> Tuple[T, T]:
     """
-    Функция обработки пары аккаунтов с возможностью начальной задержки.
-    
-    :param delay_start: Начальная задержка перед стартом пары (в секундах)
+    Run two independent per-account calls concurrently and return (short, long) results.
+
+    Both calls finish before an error from either is re-raised, so cleanup never races a leg still in flight.
     """
-    # Добавляем начальную задержку для распределения нагрузки
-    if delay_start > 0:
-        logging.info(f"Пара {short_cfg['name']}/{long_cfg['name']} ожидает {delay_start:.1f}с перед запуском")
-        time.sleep(delay_start)
-        
-    short_acc = SubAccount(short_cfg, is_long=False, leverage=float(cfg.get("leverage", LEVERAGE_DEFAULT)))
-    long_acc = SubAccount(long_cfg, is_long=True, leverage=float(cfg.get("leverage", LEVERAGE_DEFAULT)))
+    short_future, long_future = submit_paired(short_call, long_call)
+    wait((short_future, long_future))
+    return short_future.result(), long_future.result()
+
+
+def emergency_cleanup(short_acc: SubAccount, long_acc: SubAccount, symbol: str, main_address: str) -> None:
+    """
+    Close whatever is open on both accounts, then sweep both, each stage concurrently.
+
+    Errors are logged per account, so a failure on one leg never skips cleanup of the other.
+    """
+    def guarded(action: str, acc: SubAccount, call: Callable[[], bool]) -> Callable[[], bool]:
+        def run() -> bool:
+            try:
+                return call()
+            except Exception as e:
+                logging.error("%s | Error during error cleanup (%s): %s", acc.name, action, e)
+                return False
+        return run
+
+    run_paired(
+        guarded("close", short_acc, lambda: short_acc.close_position(symbol)),
+        guarded("close", long_acc, lambda: long_acc.close_position(symbol)),
+    )
+    run_paired(
+        guarded("sweep", short_acc, lambda: short_acc.sweep(main_address)),
+        guarded("sweep", long_acc, lambda: long_acc.sweep(main_address)),
+    )
+
+
+def worker_pair(pair: PairCfg, cfg: BotCfg) -> None:
+    """
+    Функция обработки пары аккаунтов.
+
+    Разнесение старта пар во времени выполняет main(): поток создается только в свой слот.
+    """
+    main_address = cfg.main_address
+    # Свой генератор у каждой пары: задержки пар не делят состояние и лок глобального random
+    rng = random.Random(os.urandom(16))
+    short_acc = SubAccount(pair.short_account, is_long=False, leverage=cfg.leverage, resync_interval=cfg.position_resync_interval)
+    long_acc = SubAccount(pair.long_account, is_long=True, leverage=cfg.leverage, resync_interval=cfg.position_resync_interval)
+    short_acc.stream.start()
+    long_acc.stream.start()
+
+    # Поток позиций будит мониторинг сразу при закрытии/ликвидации любой из позиций пары
+    position_closed = threading.Event()
+    short_acc.stream.notify_on_close(position_closed)
+    long_acc.stream.notify_on_close(position_closed)
+    _SHUTDOWN_WAKERS.append(position_closed)
     
     # Остальной код функции worker_pair остается без изменений
     # ...
     
     # Настройка задержек из конфигурации
-    action_cfg = cfg.get("action_delay", {})
-    short_acc.min_delay = float(action_cfg.get("min", 1))
-    short_acc.max_delay = float(action_cfg.get("max", short_acc.min_delay))
-    long_acc.min_delay = short_acc.min_delay
-    long_acc.max_delay = short_acc.max_delay
+    short_acc.min_delay = long_acc.min_delay = cfg.action_delay_min
+    short_acc.max_delay = long_acc.max_delay = cfg.action_delay_max
     
-    parent = AuthenticationClient(cfg["api"]["key"], cfg["api"]["secret"])
-    symbol = cfg["symbol"]
-    check_interval = float(cfg.get("check_interval", 10))
-    deposit_amt = float(cfg.get("initial_deposit", 0))
+    parent = get_auth_client(cfg.api_key, cfg.api_secret)
+    symbol = cfg.symbol
+    check_interval = cfg.check_interval
+    short_acc.trader.price_ttl = check_interval
+    long_acc.trader.price_ttl = check_interval
+    # Страховочный опрос: после открытия - часто, затем реже, пока цена стоит на месте
+    check_interval_min = cfg.check_interval_min
+    check_interval_max = cfg.check_interval_max
+    poll_backoff_base = cfg.poll_backoff_base
+    poll_reset_move = cfg.poll_reset_price_move
+    deposit_amt = cfg.initial_deposit
     
-    while True:
+    while not SHUTDOWN.is_set():
         # Сбрасываем флаги для нового цикла
         short_position_opened = False
         long_position_opened = False
         
         try:
             # 1. Депозит на оба суб-аккаунта с задержками между депозитами
-            logging.info(f"Starting new cycle with {deposit_amt} USDC deposits")
+            logging.info("Starting new cycle with %s USDC deposits", deposit_amt)
             
             # Функция для выполнения депозита с повторными попытками
             def deposit_with_retries(account_address, account_name, max_attempts=5):
@@ -552,56 +1175,54 @@ def worker_pair(short_cfg: Dict, long_cfg: Dict, cfg: Dict, main_address: str, d
                             quantity=f"{deposit_amt:.6f}",
                             symbol=USDC
                         )
-                        logging.info(f"{account_name} | Deposited {deposit_amt:.6f} USDC")
+                        logging.info("%s | Deposited %.6f USDC", account_name, deposit_amt)
                         return True
                     except Exception as e:
-                        logging.error(f"{account_name} | Deposit error (attempt {deposit_attempt+1}/{max_attempts}): {e}")
+                        logging.error("%s | Deposit error (attempt %s/%s): %s", account_name, deposit_attempt+1, max_attempts, e)
                         
                         # Если это не последняя попытка, делаем паузу и пробуем снова
                         if deposit_attempt < max_attempts - 1:
-                            delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                            logging.info(f"{account_name} | Waiting {delay:.1f}s before next deposit attempt")
-                            time.sleep(delay)
+                            delay = rng.uniform(short_acc.min_delay, short_acc.max_delay)
+                            logging.info("%s | Waiting %.1fs before next deposit attempt", account_name, delay)
+                            if SHUTDOWN.wait(delay):
+                                return False
                 
-                logging.error(f"{account_name} | Failed to deposit after {max_attempts} attempts")
+                logging.error("%s | Failed to deposit after %s attempts", account_name, max_attempts)
                 return False
 
-            # Депозит на short аккаунт
-            short_deposit_success = deposit_with_retries(short_acc.address, short_acc.name)
-
-            # Задержка между депозитами согласно конфигу
-            if short_deposit_success:
-                delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                logging.info(f"Delaying {delay:.1f}s between deposits")
-                time.sleep(delay)
-            else:
-                logging.warning(f"Skipping delay as short account deposit failed")
-
-            # Депозит на long аккаунт
-            long_deposit_success = deposit_with_retries(long_acc.address, long_acc.name)
+            # Депозиты на short и long аккаунты параллельно (batch-эндпоинта для выводов нет)
+            short_deposit_success, long_deposit_success = run_paired(
+                lambda: deposit_with_retries(short_acc.address, short_acc.name),
+                lambda: deposit_with_retries(long_acc.address, long_acc.name),
+            )
 
             # Проверяем, что хотя бы один депозит прошел успешно
             if not (short_deposit_success or long_deposit_success):
-                logging.error(f"Both deposits failed, restarting cycle")
-                time.sleep(5)  # Небольшая задержка перед новой попыткой цикла
+                logging.error("Both deposits failed, restarting cycle")
+                SHUTDOWN.wait(5)  # Небольшая задержка перед новой попыткой цикла
                 continue  # Переходим к следующей итерации цикла
 
             # 2. Случайная задержка перед открытием позиций (из конфига)
-            delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-            logging.info(f"Delaying {delay:.1f}s before opening positions")
-            time.sleep(delay)
+            delay = rng.uniform(short_acc.min_delay, short_acc.max_delay)
+            logging.info("Delaying %.1fs before opening positions", delay)
+            if SHUTDOWN.wait(delay):
+                # Позиции еще не открыты - только возвращаем депозиты
+                logging.info("%s / %s | Остановка до открытия позиций, выводим средства", short_acc.name, long_acc.name)
+                run_paired(lambda: short_acc.sweep(main_address), lambda: long_acc.sweep(main_address))
+                break
             
-            # 3. Открытие позиций на обоих аккаунтах
-            short_position_opened = short_acc.open_position(symbol)
-            long_position_opened = long_acc.open_position(symbol)
+            # 3. Открытие позиций на обоих аккаунтах одновременно
+            short_position_opened, long_position_opened = run_paired(
+                lambda: short_acc.open_position(symbol),
+                lambda: long_acc.open_position(symbol),
+            )
 
             # Проверяем, открылась ли хотя бы одна позиция
             if not (short_position_opened or long_position_opened):
                 logging.error("Failed to open positions on both accounts, restarting cycle")
                 # Попытка вывести средства перед перезапуском цикла
-                short_acc.sweep(main_address)
-                long_acc.sweep(main_address)
-                time.sleep(3)
+                run_paired(lambda: short_acc.sweep(main_address), lambda: long_acc.sweep(main_address))
+                SHUTDOWN.wait(3)
                 continue
 
             # Add a force_monitoring flag for cases where positions might not be visible via API
@@ -611,104 +1232,337 @@ def worker_pair(short_cfg: Dict, long_cfg: Dict, cfg: Dict, main_address: str, d
             if short_position_opened or long_position_opened:
                 logging.info("Позиции открыты, ожидаем перед началом мониторинга")
                 # Используем задержку из конфига (action_delay)
-                delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                logging.info(f"Задержка {delay:.1f}с перед проверкой позиций")
-                time.sleep(delay)
+                delay = rng.uniform(short_acc.min_delay, short_acc.max_delay)
+                logging.info("Задержка %.1fс перед проверкой позиций", delay)
+                SHUTDOWN.wait(delay)
 
                 # Проверяем наличие позиций
-                short_visible = short_acc.has_position(symbol) if short_position_opened else False
-                long_visible = long_acc.has_position(symbol) if long_position_opened else False
+                short_visible, long_visible = run_paired(
+                    lambda: short_position_opened and short_acc.has_position(symbol) is not None,
+                    lambda: long_position_opened and long_acc.has_position(symbol) is not None,
+                )
 
-                logging.info(f"Статус позиций - SHORT: {'видна' if short_visible else 'не видна'}, LONG: {'видна' if long_visible else 'не видна'}")
+                logging.info("Статус позиций - SHORT: %s, LONG: %s", 'видна' if short_visible else 'не видна', 'видна' if long_visible else 'не видна')
                 
                 # Сразу начинаем мониторинг, если позиции видны
                 if short_visible or long_visible:
-                    logging.info(f"Начинаем мониторинг позиций с интервалом {check_interval}с")
+                    logging.info("Начинаем мониторинг позиций с интервалом %s-%sс", check_interval_min, check_interval_max)
                     
                 # 4. Мониторинг позиций на предмет ликвидации
                 liquidation_detected = False
                 monitoring_start_time = time.time()
                 max_monitoring_time = 3600 * 24  # 24 часа максимального мониторинга
+                poll_interval = check_interval_min
+                ref_price = TICKER_STREAM.price(symbol)
+                short_pos = long_pos = None
+                # False - последняя проверка ноги не удалась (или еще не выполнялась), позиция неизвестна
+                short_known = long_known = False
+
+                def observe(acc: SubAccount) -> Tuple[Optional[Dict], bool]:
+                    try:
+                        return acc.fetch_position(symbol), True
+                    except Exception as e:
+                        logging.warning("%s | Ошибка при проверке позиций: %s", acc.name, e)
+                        return None, False
                     
                 while time.time() - monitoring_start_time < max_monitoring_time:
-                        # Продолжение мониторинга...
-                    short_has_position = short_acc.has_position(symbol)
-                    long_has_position = long_acc.has_position(symbol)
+                    # Сбрасываем событие до проверки, чтобы не пропустить закрытие между проверкой и ожиданием
+                    position_closed.clear()
+                    (short_pos, short_known), (long_pos, long_known) = run_paired(
+                        lambda: observe(short_acc),
+                        lambda: observe(long_acc),
+                    )
+                    short_has_position = short_pos is not None
+                    long_has_position = long_pos is not None
+
+                    if SHUTDOWN.is_set():
+                        # Остановка: выжившие позиции закрываются и средства выводятся как после ликвидации
+                        logging.info("%s / %s | Остановка, закрываем позиции", short_acc.name, long_acc.name)
+                        break
+
+                    if not (short_known and long_known):
+                        # Неудачный запрос - не ликвидация: повторяем проверку через минимальный интервал
+                        position_closed.wait(check_interval_min * rng.uniform(0.8, 1.2))
+                        continue
                     
-                    logging.info(f"Результат проверки позиций - SHORT: {short_has_position}, LONG: {long_has_position}")
+                    # Каждый тик мониторинга - только DEBUG; смены состояния логирует has_position
+                    logging.debug("Результат проверки позиций - SHORT: %s, LONG: %s", short_has_position, long_has_position)
                     
                     # Проверка на ликвидацию
                     if short_position_opened and not short_has_position:
-                        logging.info(f"Короткая позиция ликвидирована или закрыта")
+                        logging.info("Короткая позиция ликвидирована или закрыта")
                         liquidation_detected = True
                         break
                         
                     if long_position_opened and not long_has_position:
-                        logging.info(f"Длинная позиция ликвидирована или закрыта")
+                        logging.info("Длинная позиция ликвидирована или закрыта")
                         liquidation_detected = True
                         break
                     
                     # Если обе позиции существуют, продолжаем мониторинг
                     if short_has_position and long_has_position:
-                        logging.info(f"Обе позиции активны, продолжаем мониторинг")
-                        time.sleep(check_interval)
+                        logging.debug("Обе позиции активны, продолжаем мониторинг")
+                        # Движение цены больше порога - ликвидация стала ближе, возвращаемся к частому опросу
+                        price = TICKER_STREAM.price(symbol)
+                        if price is not None and (ref_price is None or abs(price - ref_price) >= ref_price * poll_reset_move):
+                            if ref_price is not None:
+                                poll_interval = check_interval_min
+                            ref_price = price
+                        # Ждем push о закрытии; опрос - страховка на случай обрыва потока,
+                        # джиттер не дает парам синхронизировать запросы
+                        position_closed.wait(poll_interval * rng.uniform(0.8, 1.2))
+                        poll_interval = min(check_interval_max, poll_interval * poll_backoff_base)
                     # Если ни одной позиции не осталось (странная ситуация)
                     elif not short_has_position and not long_has_position:
-                        logging.warning(f"Обе позиции исчезли, завершаем мониторинг")
+                        logging.warning("Обе позиции исчезли, завершаем мониторинг")
                         liquidation_detected = True
                         break
                     else:
                         # Одна позиция исчезла - это ликвидация
-                        logging.info(f"Одна позиция ликвидирована, завершаем мониторинг")
+                        logging.info("Одна позиция ликвидирована, завершаем мониторинг")
                         liquidation_detected = True
                         break
             
                 # 5. Закрытие выживших позиций
-                if short_position_opened and short_acc.has_position(symbol):
-                    logging.info(f"Closing surviving short position")
-                    short_acc.close_position(symbol)
-                    
-                if long_position_opened and long_acc.has_position(symbol):
-                    logging.info(f"Closing surviving long position")
-                    long_acc.close_position(symbol)
-
-                # Задержка после закрытия позиций, перед выводом средств
-                delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                logging.info(f"Delaying {delay:.1f}s after closing positions, before sweeping funds")
-                time.sleep(delay)
-
-                # 6. Свип средств на основной счет
-                logging.info(f"Sweeping funds back to main account")
+                # Успешно проверенные ноги берем из последней проверки мониторинга - повторно не запрашиваем;
+                # ногу с неудачной последней проверкой close_position запрашивает заново. Закрытия независимы
+                def close_leg(acc: SubAccount, opened: bool, known: bool, pos: Optional[Dict]) -> bool:
+                    if not opened or (known and pos is None):
+                        return True
+                    return acc.close_position(symbol, pos)
 
-                # Свип средств с short аккаунта
-                short_sweep_success = short_acc.sweep(main_address)
+                if short_pos is not None or long_pos is not None or not (short_known and long_known):
+                    logging.info("Closing surviving positions")
+                    run_paired(
+                        lambda: close_leg(short_acc, short_position_opened, short_known, short_pos),
+                        lambda: close_leg(long_acc, long_position_opened, long_known, long_pos),
+                    )
 
-                # Задержка между выводами согласно конфигу
-                delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                logging.info(f"Delaying {delay:.1f}s between sweeps")
+                # Задержка после закрытия позиций, перед выводом средств: reduce-only закрытие должно
+                # завершиться, иначе sweep прочитает заблокированный или частичный баланс.
+                # Не прерывается остановкой - при остановке вывод тоже идет после закрытия
+                delay = rng.uniform(short_acc.min_delay, short_acc.max_delay)
+                logging.info("Delaying %.1fs after closing positions, before sweeping funds", delay)
                 time.sleep(delay)
 
-                # Свип средств с long аккаунта
-                long_sweep_success = long_acc.sweep(main_address)
-
-                # Задержка перед следующим циклом
-                delay = random.uniform(short_acc.min_delay, short_acc.max_delay)
-                logging.info(f"Delaying {delay:.1f}s before starting next cycle")
-                time.sleep(delay)
+                # 6. Свип средств на основной счет с обоих аккаунтов параллельно; задержка перед
+                # следующим циклом идет одновременно со свипом
+                delay = rng.uniform(short_acc.min_delay, short_acc.max_delay)
+                logging.info("Sweeping funds back to main account, next cycle in %.1fs", delay)
+                short_sweep, long_sweep = submit_paired(
+                    lambda: short_acc.sweep(main_address),
+                    lambda: long_acc.sweep(main_address),
+                )
+                SHUTDOWN.wait(delay)
+                short_sweep_success, long_sweep_success = short_sweep.result(), long_sweep.result()
             
         except Exception as e:
-            logging.error(f"Critical error in worker cycle: {e}")
+            logging.error("Critical error in worker cycle: %s", e)
             # В случае критической ошибки пытаемся закрыть позиции и вывести средства
-            try:
-                if short_acc.has_position(symbol):
-                    short_acc.close_position(symbol)
-                if long_acc.has_position(symbol):
-                    long_acc.close_position(symbol)
-                short_acc.sweep(main_address)
-                long_acc.sweep(main_address)
-            except Exception as cleanup_error:
-                logging.error(f"Error during error cleanup: {cleanup_error}")
-            time.sleep(10)  # Подольше ждем перед новой попыткой после критической ошибки
+            emergency_cleanup(short_acc, long_acc, symbol, main_address)
+            SHUTDOWN.wait(10)  # Подольше ждем перед новой попыткой после критической ошибки
+
+    logging.info("%s / %s | Пара остановлена", short_acc.name, long_acc.name)
+
+
+CONFIG_CACHE_DIR = Path.home() / ".cache" / "backpack_bot"
+# libyaml (C) в 5-10 раз быстрее чистого Python; не во всех сборках PyYAML он есть
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def load_config(path: Path, cache_dir: Path = CONFIG_CACHE_DIR) -> Dict:
+    """
+    Load config.yaml, reusing a pickled copy while the file's mtime and size are unchanged.
+
+    The copy holds the API secrets in plain text: one owner-only file per config path under
+    `cache_dir`, overwritten on every change. `config_cache: false` in the YAML disables the
+    cache and removes the file. Any cache problem falls back to YAML.
+    """
+    resolved = path.resolve()
+    st = path.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    cache_path = cache_dir / f"config-{hashlib.sha256(str(resolved).encode()).hexdigest()[:16]}.pkl"
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, cached_config = pickle.load(f)
+        if cached_key == key:
+            return cached_config
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning("Config cache unreadable, parsing %s: %s", path, e)
+
+    with open(path, "r") as f:
+        config = yaml.load(f, Loader=YAML_LOADER)
+
+    if isinstance(config, dict) and config.get("config_cache") is False:
+        # Кэш выключен: удаляем копию с ключами, оставшуюся с прошлых запусков
+        try:
+            cache_path.unlink(missing_ok=True)
+        except OSError as e:
+            logging.warning("Could not remove config cache %s: %s", cache_path, e)
+        return config
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+        fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((key, config), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logging.warning("Could not write config cache: %s", e)
+    return config
+
+
+@dataclass(frozen=True, slots=True)
+class AccountCfg:
+    name: str
+    address: str
+    api_key: str
+    api_secret: str
+
+    @classmethod
+    def from_dict(cls, raw: Dict) -> AccountCfg:
+        return cls(str(raw["name"]), str(raw["address"]), str(raw["api_key"]), str(raw["api_secret"]))
+
+
+@dataclass(frozen=True, slots=True)
+class PairCfg:
+    short_account: AccountCfg
+    long_account: AccountCfg
+
+
+@dataclass(frozen=True, slots=True)
+class BotCfg:
+    """
+    Validated, immutable bot settings parsed once from config.yaml and shared by all pair threads.
+
+    Optional keys get the same defaults the workers used to apply on every lookup.
+    """
+
+    main_address: str
+    api_key: str
+    api_secret: str
+    symbol: str
+    pairs: Tuple[PairCfg, ...]
+    initial_deposit: float = 0.0
+    leverage: float = LEVERAGE_DEFAULT
+    check_interval: float = 10.0
+    check_interval_min: float = 10.0
+    check_interval_max: float = 10.0
+    poll_backoff_base: float = 1.5
+    poll_reset_price_move: float = 0.005
+    position_resync_interval: float = 300.0
+    action_delay_min: float = 1.0
+    action_delay_max: float = 1.0
+    pair_start_delay_max: float = 60.0
+    shutdown_timeout: float = SHUTDOWN_TIMEOUT
+    rate_limit_per_second: float = RATE_LIMIT_PER_SEC
+    rate_limit_burst: float = RATE_LIMIT_BURST
+    public_concurrency: int = PUBLIC_CONCURRENCY
+    private_concurrency: int = PRIVATE_CONCURRENCY
+    console_log_level: str = "INFO"
+
+    @classmethod
+    def from_dict(cls, config: Dict) -> BotCfg:
+        """Build settings from the parsed YAML; raises ValueError/KeyError on invalid configuration."""
+        main_address = (config.get("main_account") or {}).get("address")
+        if not main_address:
+            raise ValueError("Main account address not configured")
+
+        pairs = []
+        for pair_config in config.get("pairs") or []:
+            short_account = pair_config.get("short_account")
+            long_account = pair_config.get("long_account")
+            if not (short_account and long_account):
+                logging.warning("Skipping pair with missing account configuration")
+                continue
+            pairs.append(PairCfg(AccountCfg.from_dict(short_account), AccountCfg.from_dict(long_account)))
+        if not pairs:
+            raise ValueError("No trading pairs configured")
+
+        check_interval = float(config.get("check_interval", 10))
+        check_interval_min = float(config.get("check_interval_min", check_interval))
+        action_cfg = config.get("action_delay") or {}
+        action_delay_min = float(action_cfg.get("min", 1))
+        rate_cfg = config.get("rate_limit") or {}
+        rate_limit_per_second = float(rate_cfg.get("per_second", RATE_LIMIT_PER_SEC))
+        rate_limit_burst = float(rate_cfg.get("burst", RATE_LIMIT_BURST))
+        public_concurrency = int(rate_cfg.get("public_concurrency", PUBLIC_CONCURRENCY))
+        private_concurrency = int(rate_cfg.get("private_concurrency", PRIVATE_CONCURRENCY))
+        # per_second=0 делит на ноль, burst<1 не вмещает целый токен, семафор 0 блокирует запросы навсегда
+        if rate_limit_per_second <= 0:
+            raise ValueError(f"rate_limit.per_second must be > 0, got {rate_limit_per_second}")
+        if rate_limit_burst < 1:
+            raise ValueError(f"rate_limit.burst must be >= 1, got {rate_limit_burst}")
+        if public_concurrency < 1 or private_concurrency < 1:
+            raise ValueError(
+                f"rate_limit.public_concurrency/private_concurrency must be >= 1, "
+                f"got {public_concurrency}/{private_concurrency}"
+            )
+        console_log_level = str(config.get("console_log_level", "INFO")).upper()
+        if not isinstance(logging.getLevelName(console_log_level), int):
+            raise ValueError(f"Unknown console_log_level: {console_log_level}")
+        return cls(
+            main_address=str(main_address),
+            api_key=str(config["api"]["key"]),
+            api_secret=str(config["api"]["secret"]),
+            symbol=str(config["symbol"]),
+            pairs=tuple(pairs),
+            initial_deposit=float(config.get("initial_deposit", 0)),
+            leverage=float(config.get("leverage", LEVERAGE_DEFAULT)),
+            check_interval=check_interval,
+            check_interval_min=check_interval_min,
+            check_interval_max=max(check_interval_min, float(config.get("check_interval_max", check_interval))),
+            poll_backoff_base=float(config.get("poll_backoff_base", 1.5)),
+            poll_reset_price_move=float(config.get("poll_reset_price_move", 0.005)),
+            position_resync_interval=float(config.get("position_resync_interval", 300)),
+            action_delay_min=action_delay_min,
+            action_delay_max=float(action_cfg.get("max", action_delay_min)),
+            pair_start_delay_max=float(config.get("pair_start_delay_max", 60)),
+            shutdown_timeout=float(config.get("shutdown_timeout", SHUTDOWN_TIMEOUT)),
+            rate_limit_per_second=rate_limit_per_second,
+            rate_limit_burst=rate_limit_burst,
+            public_concurrency=public_concurrency,
+            private_concurrency=private_concurrency,
+            console_log_level=console_log_level,
+        )
+
+
+# Форматтеры не зависят от конфига - создаются один раз при импорте
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+CONSOLE_FORMATTER = colorlog.ColoredFormatter(
+    '%(log_color)s' + LOG_FORMAT,
+    log_colors={
+        'DEBUG': 'cyan',
+        'INFO': 'green',
+        'WARNING': 'yellow',
+        'ERROR': 'red',
+        'CRITICAL': 'red,bg_white',
+    }
+)
+# Файл - по записи JSON на строку (для jq и систем мониторинга), без цветовых кодов;
+# без python-json-logger - обычный текст
+FILE_FORMATTER = (
+    JsonFormatter('%(asctime)s %(levelname)s %(name)s %(message)s')
+    if JsonFormatter is not None
+    else logging.Formatter(LOG_FORMAT)
+)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process queue: records are enqueued as is.
+
+    The stock handler formats message and traceback in the calling thread (needed only
+    when records cross a process boundary); here all formatting happens in the listener.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
 
 def main():
     """Initialize and run the bot using configuration from config.yaml."""
@@ -721,87 +1575,92 @@ def main():
     log_path = logs_dir / log_filename
     
     # Setup colored logging
-    import colorlog
-    
     handler = colorlog.StreamHandler()
-    handler.setFormatter(
-        colorlog.ColoredFormatter(
-            '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
-            log_colors={
-                'DEBUG': 'cyan',
-                'INFO': 'green',
-                'WARNING': 'yellow',
-                'ERROR': 'red',
-                'CRITICAL': 'red,bg_white',
-            }
-        )
-    )
+    handler.setFormatter(CONSOLE_FORMATTER)
     
     # Файловый обработчик логов теперь записывает в папку logs
     file_handler = logging.FileHandler(log_path)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    file_handler.setFormatter(FILE_FORMATTER)
     
+    # Рабочие потоки только кладут запись в очередь; форматирование и запись в консоль/файл
+    # выполняет поток QueueListener, вне лока логгера и горячего цикла мониторинга
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, file_handler, respect_handler_level=True)
+    listener.start()
+    # Дописываем записи, оставшиеся в очереди, при любом выходе (в т.ч. sys.exit при ошибке конфига)
+    atexit.register(listener.stop)
+
     logger = colorlog.getLogger()
-    logger.addHandler(handler)
-    logger.addHandler(file_handler)
+    logger.addHandler(LocalQueueHandler(log_queue))
     logger.setLevel(logging.INFO)
     
-    logging.info(f"Запуск бота. Логи сохраняются в {log_path}")
+    logging.info("Запуск бота. Логи сохраняются в %s", log_path)
     
     # Load configuration
     config_path = Path("config.yaml")
     if not config_path.exists():
-        logging.error(f"Configuration file not found: {config_path}")
+        logging.error("Configuration file not found: %s", config_path)
         sys.exit(1)
         
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f)
-    
-    # Validate configuration
-    if not config.get("main_account", {}).get("address"):
-        logging.error("Main account address not configured")
-        sys.exit(1)
-        
-    pairs = config.get("pairs", [])
-    if not pairs:
-        logging.error("No trading pairs configured")
+    # Конфиг проверяется один раз при старте: потоки пар получают готовый неизменяемый BotCfg
+    try:
+        cfg = BotCfg.from_dict(load_config(config_path))
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        logging.error("Invalid configuration: %s", e)
         sys.exit(1)
+
+    # Файл получает все записи; консоль можно ограничить (WARNING в продакшене), чтобы
+    # INFO мониторинга не раскрашивались и не выводились в терминал
+    handler.setLevel(cfg.console_log_level)
+    logging.info("Starting Backpack liquidation bot with %s pair(s)", len(cfg.pairs))
     
-    main_address = config["main_account"]["address"]
-    logging.info(f"Starting Backpack liquidation bot with {len(pairs)} pair(s)")
-    
-    # Start worker threads for each pair
-    threads = []
     # Максимальная начальная задержка из конфига или 60 секунд по умолчанию
-    max_initial_delay = float(config.get("pair_start_delay_max", 60))
+    max_initial_delay = cfg.pair_start_delay_max
+    RATE_LIMITER.configure(cfg.rate_limit_per_second, cfg.rate_limit_burst)
+    HTTP_SESSION.set_concurrency(cfg.public_concurrency, cfg.private_concurrency)
+    shutdown_timeout = cfg.shutdown_timeout
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
 
-    for i, pair_config in enumerate(pairs):
-        short_account = pair_config.get("short_account")
-        long_account = pair_config.get("long_account")
-        
-        if not (short_account and long_account):
-            logging.warning(f"Skipping pair with missing account configuration")
-            continue
-            
-        # Добавляем случайную начальную задержку для равномерного распределения
-        initial_delay = random.uniform(0, max_initial_delay)
-        
+    # Пары стартуют через равные интервалы в пределах pair_start_delay_max,
+    # поток пары создается только в свой слот, а не спит внутри worker_pair
+    slot = max_initial_delay / len(cfg.pairs)
+    # Парные вызовы всех пар идут через общий пул, а не через новые потоки на каждый тик мониторинга
+    start_paired_pool(len(cfg.pairs))
+    atexit.register(HTTP_SESSION.close)
+    # Моменты старта рассчитываются заранее от общего t0: время запуска потоков не накапливается в сдвиг
+    started_at = time.monotonic()
+    start_offsets = [i * slot for i in range(len(cfg.pairs))]
+    threads = []
+    for i, (pair, offset) in enumerate(zip(cfg.pairs, start_offsets)):
+        if i and SHUTDOWN.wait(max(0.0, started_at + offset - time.monotonic())):
+            break
         thread = threading.Thread(
             target=worker_pair,
-            args=(short_account, long_account, config, main_address, initial_delay),
+            args=(pair, cfg),
             daemon=True
         )
         thread.start()
         threads.append(thread)
-        logging.info(f"Started worker thread for {short_account['name']} / {long_account['name']} with {initial_delay:.1f}s initial delay")
-    
-    # Wait for all threads
-    try:
-        for thread in threads:
-            thread.join()
-    except KeyboardInterrupt:
-        logging.info("Received keyboard interrupt, shutting down...")
-        sys.exit(0)
+        logging.info("Started worker thread for %s / %s at +%.1fs", pair.short_account.name, pair.long_account.name, offset)
+
+    # Ждем сигнал остановки; таймаут оставляет главному потоку возможность обработать сигнал
+    while not SHUTDOWN.wait(1.0):
+        if not any(thread.is_alive() for thread in threads):
+            return
+
+    logging.info("Received shutdown signal, waiting up to %.0fs for pairs to close positions and sweep funds...", shutdown_timeout)
+    deadline = time.monotonic() + shutdown_timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    still_running = sum(thread.is_alive() for thread in threads)
+    if still_running:
+        logging.error("%s pair(s) did not finish cleanup in %.0fs, exiting anyway", still_running, shutdown_timeout)
+        # sys.exit ждал бы незавершенные задачи пула (его потоки не daemon) без ограничения по времени;
+        # дописываем логи и завершаем процесс сразу
+        listener.stop()
+        os._exit(1)
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()